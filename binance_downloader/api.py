@@ -1,3 +1,8 @@
+import gzip
+import os
+from collections import deque
+from importlib.util import find_spec
+from itertools import islice
 from multiprocessing.pool import ThreadPool
 from typing import Tuple, Optional
 
@@ -6,26 +11,67 @@ from logbook import Logger
 from tqdm import tqdm
 
 from .binance_utils import (
+    api_session,
     max_request_freq,
-    KLINE_INTERVALS,
+    KLINE_COLUMNS,
+    KLINE_INTERVAL_SET,
+    KLINE_REQUEST_WEIGHT,
     interval_to_milliseconds,
     date_to_milliseconds,
     get_klines,
     earliest_valid_timestamp,
-    kline_df_from_flat_list,
+    combine_kline_frames,
+    kline_frame,
+    kline_ranges,
     KLINE_URL,
 )
-from .utils import ensure_dir, rate_limited
+from .utils import WRITE_BUFFER_SIZE, AIMDLimiter, TokenBucket, ensure_dir
 
 # Set up LogBook logging
 log = Logger(__name__)
 
+# Default number of threads making k-line requests concurrently
+DEFAULT_WORKERS = 16
 
-class BinanceAPI:
+# Request windows each worker may have requested or waiting to be written when
+# streaming, which bounds memory use however long the date range is
+WINDOWS_IN_FLIGHT_PER_WORKER = 2
+
+# gzip level for .gz csv output: level 1 gives most of the size reduction of
+# higher levels at a fraction of their CPU cost
+GZIP_LEVEL = 1
+
+
+# Output file extensions written in a columnar binary format with pyarrow
+PYARROW_EXTENSIONS = (".parquet", ".feather")
+
+
+def check_output_format(output: Optional[str]) -> None:
+    """Fail early if `output` can't be written, rather than after a long download
+
+    :param output: output file path (None for the default csv file)
+    :return: None
+    :raises ImportError: if the output format needs pyarrow and it isn't installed
+    """
+    if not output:
+        return
+    extension = os.path.splitext(output)[1].lower()
+    if extension in PYARROW_EXTENSIONS and find_spec("pyarrow") is None:
+        raise ImportError(
+            f"Writing {extension} output requires pyarrow: pip install pyarrow"
+        )
 
-    max_per_sec = max_request_freq(req_weight=1)
 
-    def __init__(self, interval, symbol, start_date, end_date):
+class BinanceAPI:
+    def __init__(
+        self,
+        interval,
+        symbol,
+        start_date,
+        end_date,
+        num_workers=DEFAULT_WORKERS,
+        columns=None,
+    ):
         self.base_url = KLINE_URL
         # Binance limit per request is 1000 items
         self.req_limit = 1000
@@ -33,80 +79,232 @@ class BinanceAPI:
         if (
             not interval
             or not isinstance(interval, str)
-            or interval not in KLINE_INTERVALS
+            or interval not in KLINE_INTERVAL_SET
         ):
             raise ValueError(
                 f"'{interval}' not recognized as valid Binance k-line interval."
             )
         self.interval = interval
+        # Interval length never changes for this instance, so only convert it once
+        self._interval_ms = interval_to_milliseconds(self.interval)
+
+        # Subset of KLINE_COLUMNS to download (None for all). Dropping unused
+        # columns saves converting, holding and writing them
+        if columns is not None:
+            unknown = set(columns) - set(KLINE_COLUMNS)
+            if unknown:
+                raise ValueError(
+                    f"{sorted(unknown)} not recognized as k-line column(s). "
+                    f"Valid columns: {KLINE_COLUMNS}"
+                )
+        self.columns = columns
 
         self.start_time, self.end_time = self._fill_dates(start_date, end_date)
 
         self.kline_df: Optional[pd.DataFrame] = None
+        self.output_path: Optional[str] = None
         self.download_successful = False
 
-    @rate_limited(max_per_sec)
+        # Requests are I/O bound and paced by Binance's rate limit, so the number
+        # of workers is set by that rather than by the CPU count
+        self.num_workers = num_workers
+
+        # Re-use keep-alive connections across all k-line requests so the TLS
+        # handshake with Binance is only paid once per pooled connection. One
+        # connection per worker means threads never wait on each other for a socket
+        self._session = api_session(pool_maxsize=self.num_workers)
+
+        # Shared by all worker threads, so that pacing (and any pause requested
+        # by Binance) applies to the download as a whole. Tokens are units of
+        # request weight, and the bucket only holds enough for one request, so
+        # requests go out evenly spaced rather than in bursts
+        weight_per_sec = (
+            max_request_freq(req_weight=KLINE_REQUEST_WEIGHT) * KLINE_REQUEST_WEIGHT
+        )
+        self._limiter = TokenBucket(weight_per_sec, capacity=KLINE_REQUEST_WEIGHT)
+        # Adapts how many of the workers may have a request in flight at once,
+        # backing off whenever Binance rejects or fails a request
+        self._concurrency = AIMDLimiter(maximum=self.num_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the pooled HTTP session used for API requests"""
+        self._session.close()
+
     def fetch_blocks(self, start_end_times):
         start, end = start_end_times
-        return get_klines(
-            self.symbol,
-            self.interval,
-            start_time=start,
-            end_time=end,
-            limit=self.req_limit,
-        )
+        self._concurrency.acquire()
+        try:
+            klines = get_klines(
+                self.symbol,
+                self.interval,
+                start_time=start,
+                end_time=end,
+                limit=self.req_limit,
+                session=self._session,
+                limiter=self._limiter,
+                concurrency=self._concurrency,
+            )
+        finally:
+            self._concurrency.release()
+        # Convert in the worker thread, overlapping with other requests' network waits
+        return kline_frame(klines, columns=self.columns)
+
+    def fetch_parallel(self, stream_to=None):
+        """Download all k-lines between the start and end dates
+
+        :param stream_to: optional csv (or .gz compressed csv) file path. If given,
+            k-lines are written to this file in order as each request window
+            arrives, instead of being collected into kline_df. Memory use stays
+            bounded to WINDOWS_IN_FLIGHT_PER_WORKER windows per worker however
+            long the date range is
+        :return: None
+        """
+        if stream_to:
+            # Check before downloading: the columnar formats can't be streamed
+            extension = os.path.splitext(stream_to)[1].lower()
+            if extension in PYARROW_EXTENSIONS:
+                raise ValueError(
+                    f"Cannot stream k-lines to {extension} output; use csv or .gz"
+                )
 
-    def fetch_parallel(self):
         # Get earliest possible kline
         earliest = earliest_valid_timestamp(self.symbol, self.interval)
         ms_start = max(self.start_time, earliest)
         ms_end = min(self.end_time, date_to_milliseconds("now"))
-        ms_interval = interval_to_milliseconds(self.interval)
+        ms_interval = self._interval_ms
 
         # Create list of all start and end timestamps
-        ranges = []
-        _start = _end = ms_start
-        while _end < ms_end - ms_interval:
-            # Add some overlap to allow for small changes in interval on
-            # Binance's side
-            _end = min(
-                _start
-                + (self.req_limit - 1) * ms_interval,  # Cover full interval in msec
-                ms_end - ms_interval,  # Cover up to given end date
+        ranges = kline_ranges(ms_start, ms_end, ms_interval, limit=self.req_limit)
+
+        if stream_to:
+            num_klines = self._stream_to_csv(ranges, stream_to)
+            self.output_path = stream_to
+        else:
+            self.kline_df = combine_kline_frames(list(self._iter_frames(ranges)))
+            num_klines = len(self.kline_df)
+
+        if num_klines == 0:
+            log.warn(
+                "there are no k-lines for {} at {} intervals on Binance between {} "
+                "and {}",
+                self.symbol,
+                self.interval,
+                pd.to_datetime(self.start_time, unit="ms"),
+                pd.to_datetime(self.end_time, unit="ms"),
             )
-            # Add to list of all intervals we need to request
-            ranges.append((_start, _end))
-            # Add overlap (duplicates filtered out later) to ensure we don't miss
-            # any of the range if Binance screwed up some of their data
-            _start = _end - ms_interval * 10
-
-        # Create workers for all needed requests and start them
-        pool = ThreadPool()
-        # Fetch in parallel, but block until all requests are received
-
-        flat_results = []
-        it = pool.imap(self.fetch_blocks, ranges)
-        # Prevent more tasks being added to the pool
-        pool.close()
-
-        # Show progress meter
-        with tqdm(total=len(ranges) * self.req_limit) as pbar:
-            for r in it:
-                pbar.update(self.req_limit)
-                flat_results.extend(r)
-
-        # Block until all workers are done
-        pool.join()
-
-        self.kline_df = kline_df_from_flat_list(flat_results)
-        if len(self.kline_df) == 0:
-            log.warn(f"there are no k-lines for {self.symbol} at {self.interval} "
-                     f"intervals on Binance between {pd.to_datetime(self.start_time, unit='ms')} "
-                     f"and {pd.to_datetime(self.end_time, unit='ms')}")
         else:
             log.info("Done fetching in parallel")
             self.download_successful = True
 
+    def _iter_frames(self, ranges, ordered=False):
+        """Yield a k-line DataFrame for each request window as it is downloaded
+
+        Unless `ordered`, frames are yielded in the order requests complete
+        """
+        if len(ranges) <= 1:
+            # A single request (e.g. the latest 1000 k-lines) gains nothing from
+            # a thread pool, so skip creating and tearing one down
+            for r in ranges:
+                yield self.fetch_blocks(r)
+            return
+
+        pool = ThreadPool(processes=min(self.num_workers, len(ranges)))
+        if ordered:
+            it = self._imap_bounded(pool, ranges)
+        else:
+            # Take results as soon as each request returns; order is restored
+            # when the k-lines are sorted into a DataFrame
+            it = pool.imap_unordered(self.fetch_blocks, ranges, chunksize=1)
+
+        try:
+            # Show progress meter, counting the k-lines each window should return
+            # (the last window is usually partial, so not always req_limit)
+            expected = sum(
+                (end - start) // self._interval_ms + 1 for start, end in ranges
+            )
+            with tqdm(total=expected, unit="kline") as pbar:
+                for r in it:
+                    pbar.update(len(r))
+                    yield r
+        finally:
+            # Stop outstanding requests if the consumer gave up early, then block
+            # until all workers are done
+            pool.terminate()
+            pool.join()
+
+    def _imap_bounded(self, pool, ranges):
+        """Yield a frame per window in order, keeping only a few windows in flight
+
+        At most WINDOWS_IN_FLIGHT_PER_WORKER windows per worker are requested or
+        held at once, and the next window is only requested as each frame is
+        taken. A slow window therefore holds back later requests instead of
+        letting every finished window pile up in memory behind it.
+        """
+        windows = iter(ranges)
+        pending = deque(
+            pool.apply_async(self.fetch_blocks, (r,))
+            for r in islice(windows, self.num_workers * WINDOWS_IN_FLIGHT_PER_WORKER)
+        )
+        while pending:
+            frame = pending.popleft().get()
+            for r in islice(windows, 1):
+                pending.append(pool.apply_async(self.fetch_blocks, (r,)))
+            yield frame
+
+    def _stream_to_csv(self, ranges, output) -> int:
+        ensure_dir(output)
+        num_klines = 0
+        last_open_time = None
+        with self._open_csv(output) as csv_file:
+            for frame in self._iter_frames(ranges, ordered=True):
+                frame = combine_kline_frames([frame])
+                if last_open_time is not None:
+                    # Windows overlap, so drop k-lines already written
+                    frame = frame[frame.OpenTime > last_open_time]
+                if len(frame) == 0:
+                    continue
+                frame.to_csv(
+                    csv_file, header=num_klines == 0, index=False, float_format="%.9f"
+                )
+                num_klines += len(frame)
+                last_open_time = frame.OpenTime.iloc[-1]
+        log.notice("Done writing {} for {} lines", output, num_klines)
+        return num_klines
+
+    def write_to_file(self, output=None):
+        """Write k-lines retrieved from Binance to disk, in a format chosen by extension
+
+        Output ending in .parquet or .feather is written in that columnar binary
+        format (requires pyarrow), which is several times faster to write and
+        much smaller on disk than CSV. Output ending in .gz (e.g. .csv.gz) is
+        written as gzip-compressed CSV. Any other output is written as CSV.
+
+        :param output: output file path. If none, will be stored in ./downloaded
+            directory with a timestamped csv filename based on symbol pair and interval
+        :return: None
+        """
+        if not self._ready_to_write():
+            return
+
+        # Generate default file name/path if none given
+        output = output or self.output_file
+        ensure_dir(output)
+
+        extension = os.path.splitext(output)[1].lower()
+        if extension == ".parquet":
+            self.kline_df.to_parquet(output, compression="snappy")
+        elif extension == ".feather":
+            self.kline_df.to_feather(output)
+        else:
+            self._write_csv(output)
+        log.notice("Done writing {} for {} lines", output, len(self.kline_df))
+
     def write_to_csv(self, output=None):
         """Write k-lines retrieved from Binance into a csv file
 
@@ -114,21 +312,46 @@ class BinanceAPI:
             directory with a timestamped filename based on symbol pair and interval
         :return: None
         """
+        if not self._ready_to_write():
+            return
+
+        # Generate default file name/path if none given
+        output = output or self.output_file
+        ensure_dir(output)
+
+        self._write_csv(output)
+        log.notice("Done writing {} for {} lines", output, len(self.kline_df))
+
+    def _ready_to_write(self) -> bool:
         if not self.download_successful:
             log.warn("Not writing to output file since no data was received from API")
-            return
+            return False
 
         if self.kline_df is None:
+            if self.output_path is not None:
+                log.warn(
+                    "Not writing to output file since k-lines were already "
+                    "streamed to {}",
+                    self.output_path,
+                )
+                return False
             raise ValueError("Must read in data from Binance before writing to disk!")
 
-        # Generate default file name/path if none given
-        output = output or self.output_file
+        return True
 
-        with open(output, "w") as csv_file:
+    @staticmethod
+    def _open_csv(output):
+        if output.lower().endswith(".gz"):
+            return gzip.open(output, "wt", compresslevel=GZIP_LEVEL)
+        # Large write buffer so the formatted rows reach the disk in a few big
+        # writes rather than many small ones
+        return open(output, "w", buffering=WRITE_BUFFER_SIZE)
+
+    def _write_csv(self, output):
+        with self._open_csv(output) as csv_file:
             # Ensure 9 decimal places  (most prices are to 8 places)
 
             self.kline_df.to_csv(csv_file, index=False, float_format="%.9f")
-        log.notice(f"Done writing {output} for {len(self.kline_df)} lines")
 
     @property
     def output_file(self, extension="csv"):
@@ -145,25 +368,29 @@ class BinanceAPI:
 
         # Get interval (in milliseconds) for limit * interval
         # (i.e. 1000 * 1m = 60,000,000 milliseconds)
-        span = int(self.req_limit) * interval_to_milliseconds(self.interval)
+        span = int(self.req_limit) * self._interval_ms
 
         if start and end:
             log.info("Found start and end dates. Fetching full interval")
             return start, end
         elif start:
             # No end date, so go forward by 1000 intervals
-            log.notice(f"Found start date but no end: fetching {self.req_limit} klines")
+            log.notice(
+                "Found start date but no end: fetching {} klines", self.req_limit
+            )
             end = start + span
         elif end:
             # No start date, so go back 1000 intervals
             log.notice(
-                f"Found end date but no start. Fetching previous {self.req_limit} klines"
+                "Found end date but no start. Fetching previous {} klines",
+                self.req_limit,
             )
             start = end - span
         else:
             # Neither start nor end date. Get most recent 1000 intervals
             log.notice(
-                f"Neither start nor end dates found. Fetching most recent {self.req_limit} klines"
+                "Neither start nor end dates found. Fetching most recent {} klines",
+                self.req_limit,
             )
             end = date_to_milliseconds("now")
             start = end - span
@@ -1,10 +1,18 @@
-from typing import List, Union
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import requests
 from logbook import Logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .utils import json_to_cache, json_from_cache
+from . import __version__
+from .utils import json_to_cache, json_from_cache, parse_json
 
 log = Logger(__name__)
 
@@ -28,9 +36,106 @@ KLINE_INTERVALS = (
     "1w",
     "1M",
 )
+# Length in seconds of each k-line interval unit (a month is counted as 30 days)
+_SECONDS_PER_UNIT = {
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+    "M": 30 * 24 * 60 * 60,
+}
+# Milliseconds in each valid k-line interval, computed once at import
+_INTERVAL_MS = {
+    interval: int(interval[:-1]) * _SECONDS_PER_UNIT[interval[-1]] * 1000
+    for interval in KLINE_INTERVALS
+}
+
+# strptime layouts for plain dates in each of the supported date formats
+_FAST_DATE_FORMATS = {"DMY": "%d/%m/%Y", "MDY": "%m/%d/%Y", "YMD": "%Y/%m/%d"}
+# strptime layouts for ISO 8601 dates and times without a UTC offset. Inputs
+# with an offset, or in any other layout, go through pandas
+_ISO_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+)
+
+# Constant-time membership checks for interval validation
+KLINE_INTERVAL_SET = frozenset(KLINE_INTERVALS)
+
+# Seconds to wait for the server to connect or send data before giving up
+REQUEST_TIMEOUT = 10
+
+# Retry transient server errors with exponential backoff. Rate limit rejections
+# (429) are handled in _get, so that every thread sharing a limiter backs off
+# together. A 418 means the IP has already been banned, so it is never retried.
+RETRY_POLICY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=(500, 502, 503, 504),
+    raise_on_status=False,
+)
+# Request weight Binance charges for each k-line request
+KLINE_REQUEST_WEIGHT = 2
+# Number of attempts made for a request that is rejected for exceeding rate limits
+RATE_LIMIT_RETRIES = 5
+# Fraction of the per-minute request weight that may be used before all requests
+# are paused until the next minute
+WEIGHT_PAUSE_FRACTION = 0.9
+
+# Error messages for API status codes that need specific handling
+_STATUS_ERRORS = {
+    429: "Rate limits exceeded",
+    418: "IP banned for exceeding rate limits",
+}
+
+# Field order of each k-line returned by the API
+KLINE_COLUMNS = [
+    "OpenTime",
+    "Open",
+    "High",
+    "Low",
+    "Close",
+    "Volume",
+    "CloseTime",
+    "qav",
+    "numTrades",
+    "tbbav",
+    "tbqav",
+    "ignore",
+]
+TIME_COLUMNS = ("OpenTime", "CloseTime")
+# Intervals by which consecutive request windows overlap
+KLINE_WINDOW_OVERLAP = 10
+# Types of the numeric k-line fields (the API sends most of them as strings).
+# The quote and taker volumes (qav, tbbav, tbqav) are kept as sent: they can be
+# too large for float64 to hold all their digits, and are written out verbatim
+KLINE_DTYPES = {
+    "Open": "float64",
+    "High": "float64",
+    "Low": "float64",
+    "Close": "float64",
+    "Volume": "float64",
+    "numTrades": "int64",
+}
 
 EXCHANGE_INFO_FILE = "exchange_info.json"
+# Length in seconds of the interval units used in exchange info rate limits
+_RATE_LIMIT_UNIT_SECONDS = {
+    "SECOND": 1,
+    "MINUTE": 60,
+    "HOUR": 60 * 60,
+    "DAY": 24 * 60 * 60,
+}
+# Seconds that exchange info loaded by this process is re-used without
+# touching the disk cache or the network
+EXCHANGE_INFO_TTL = 60 * 60
+_EXCHANGE_INFO_CACHE = {"data": None, "loaded": 0.0}
 EARLIEST_TIMESTAMPS_FILE = "earliest_timestamps.json"
+# Serializes read-modify-write of the earliest timestamps cache file
+_EARLIEST_TIMESTAMPS_LOCK = threading.Lock()
 
 
 def max_request_freq(req_weight: int = 1) -> float:
@@ -47,18 +152,14 @@ def max_request_freq(req_weight: int = 1) -> float:
     # from the server if cached data is too old
     request_limits = _req_limits(get_exchange_info())
 
-    for rate in request_limits:
-        # Convert JSON response components (e.g.) "5" "minutes" to a Timedelta
-        interval = pd.Timedelta(f"{rate['intervalNum']} {rate['interval']}")
-        # Frequency (requests/second) is, e.g., 5000 / 300 sec or 1200 / 60 sec
-        rate["req_freq"] = int(rate["limit"]) / interval.total_seconds()
-
     max_allowed_freq = None
 
     for limit in request_limits:
+        # Frequency (requests/second) is, e.g., 5000 / 300 sec or 1200 / 60 sec
+        req_freq = int(limit["limit"]) / _rate_limit_seconds(limit)
         # RAW_REQUESTS type should be treated as a request weight of 1
         weight = req_weight if limit["rateLimitType"] == "REQUEST_WEIGHT" else 1
-        this_allowed_freq = limit["req_freq"] / weight
+        this_allowed_freq = req_freq / weight
 
         if max_allowed_freq is None:
             max_allowed_freq = this_allowed_freq
@@ -66,8 +167,9 @@ def max_request_freq(req_weight: int = 1) -> float:
             max_allowed_freq = min(max_allowed_freq, this_allowed_freq)
 
     log.info(
-        f"Maximum permitted request frequency for weight {req_weight} is "
-        f"{max_allowed_freq} / sec"
+        "Maximum permitted request frequency for weight {} is {} / sec",
+        req_weight,
+        max_allowed_freq,
     )
 
     if max_allowed_freq is None:
@@ -76,6 +178,16 @@ def max_request_freq(req_weight: int = 1) -> float:
         return max_allowed_freq
 
 
+def _rate_limit_seconds(rate: dict) -> float:
+    # Convert JSON response components (e.g.) "5" "MINUTE" to seconds
+    unit_seconds = _RATE_LIMIT_UNIT_SECONDS.get(rate["interval"].upper())
+    if unit_seconds is None:
+        # Unexpected unit; let pandas try to make sense of it
+        interval = pd.Timedelta(f"{rate['intervalNum']} {rate['interval']}")
+        return interval.total_seconds()
+    return int(rate["intervalNum"]) * unit_seconds
+
+
 def _req_limits(exchange_info: dict) -> List:
     return [
         rate
@@ -84,39 +196,65 @@ def _req_limits(exchange_info: dict) -> List:
     ]
 
 
-def get_exchange_info() -> dict:
+def get_exchange_info(force_refresh: bool = False) -> dict:
+    """Get Binance exchange metadata (rate limits, symbols, etc.)
+
+    Exchange info is cached in memory for EXCHANGE_INFO_TTL seconds and on disk
+    for a day, since it rarely changes.
+
+    :param force_refresh: (bool) ignore both caches and pull from the server
+    :return: dict of exchange info
+    """
+    # Use the copy already loaded by this process if it is recent enough
+    cached = _EXCHANGE_INFO_CACHE["data"]
+    if (
+        not force_refresh
+        and cached is not None
+        and time.monotonic() - _EXCHANGE_INFO_CACHE["loaded"] < EXCHANGE_INFO_TTL
+    ):
+        return cached
+
     # Try to read in from disk:
-    max_age = pd.Timedelta("1 day")
-    prev_json = json_from_cache(EXCHANGE_INFO_FILE)
+    max_age = timedelta(days=1)
+    prev_json = None if force_refresh else json_from_cache(EXCHANGE_INFO_FILE)
     if prev_json:
-        old_timestamp = pd.to_datetime(
-            prev_json.get("serverTime", None), unit="ms", utc=True
-        )
-        age = pd.Timestamp("now", tz="utc") - old_timestamp
+        server_time = prev_json.get("serverTime", None)
+        age = None
+        if server_time:
+            old_timestamp = datetime.fromtimestamp(server_time / 1000, timezone.utc)
+            age = datetime.now(timezone.utc) - old_timestamp
 
-        if old_timestamp and age <= max_age:
+        if age is not None and age <= max_age:
             # Data is OK to use
             log.info(
-                f"Using cached exchange info since age ({age}) is less than {max_age}"
+                "Using cached exchange info since age ({}) is less than {}",
+                age,
+                max_age,
             )
+            _remember_exchange_info(prev_json)
             return prev_json
         else:
             # Otherwise, get it again
             log.notice("Cached exchange info unavailable or stale; pulling from server")
 
-    response = requests.get(BASE_URL + "/exchangeInfo")
-    _validate_api_response(response)
-    data = response.json()
+    response = _get(BASE_URL + "/exchangeInfo")
+    data = parse_json(response.content)
 
     # Write out to disk for next time
     json_to_cache(data, EXCHANGE_INFO_FILE)
 
     if isinstance(data, dict):
+        _remember_exchange_info(data)
         return data
     else:
         raise ConnectionError("No exchange info returned from Binance")
 
 
+def _remember_exchange_info(data: dict) -> None:
+    _EXCHANGE_INFO_CACHE["data"] = data
+    _EXCHANGE_INFO_CACHE["loaded"] = time.monotonic()
+
+
 def interval_to_milliseconds(interval) -> Union[int, None]:
     """Tries to get milliseconds from an interval input
 
@@ -125,20 +263,53 @@ def interval_to_milliseconds(interval) -> Union[int, None]:
         milliseconds for a Binance API call
     :return: (int) milliseconds of the interval if successful, otherwise None
     """
+    # Fast path for the valid Binance intervals
+    if isinstance(interval, str):
+        interval_ms = _INTERVAL_MS.get(interval)
+        if interval_ms is not None:
+            return interval_ms
+
     if isinstance(interval, pd.Timedelta):
         return int(interval.total_seconds() * 1000)
     elif isinstance(interval, int):
-        log.info(f"Assuming interval '{interval}' is already in milliseconds")
+        log.info("Assuming interval '{}' is already in milliseconds", interval)
         return interval
     # Try to convert from a string
-    seconds_per_unit = {"m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
     try:
-        return int(interval[:-1]) * seconds_per_unit[interval[-1]] * 1000
+        return int(interval[:-1]) * _SECONDS_PER_UNIT[interval[-1]] * 1000
     except (ValueError, KeyError):
         return None
 
 
 def date_to_milliseconds(date_str, date_format="YMD") -> int:
+    # The current time is requested on every download, no parsing needed
+    if isinstance(date_str, str) and date_str.lower() in ("now", "now utc"):
+        return int(time.time() * 1000)
+
+    # Integers are taken to be epoch milliseconds already, as in get_klines
+    if isinstance(date_str, (int, np.integer)):
+        return int(date_str)
+
+    # ISO 8601 dates and times without a UTC offset (e.g. 2018-05-05 12:00)
+    if isinstance(date_str, str) and len(date_str) >= 10 and date_str[4] == "-":
+        for iso_format in _ISO_DATE_FORMATS:
+            try:
+                d = datetime.strptime(date_str, iso_format)
+            except ValueError:
+                continue
+            return int(d.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+    # Plain dates in the expected layout (the CLI's input) don't need pandas'
+    # general-purpose parser
+    fast_format = _FAST_DATE_FORMATS.get(date_format.upper())
+    if fast_format and isinstance(date_str, str):
+        try:
+            d = datetime.strptime(date_str, fast_format)
+        except ValueError:
+            pass
+        else:
+            return int(d.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
     day_first = date_format.upper() == "DMY"
     year_first = date_format.upper() == "YMD"
     epoch = pd.Timestamp(0, tz="utc")
@@ -149,7 +320,14 @@ def date_to_milliseconds(date_str, date_format="YMD") -> int:
 
 
 def get_klines(
-    symbol, interval: str, start_time=None, end_time=None, limit=None
+    symbol,
+    interval: str,
+    start_time=None,
+    end_time=None,
+    limit=None,
+    session=None,
+    limiter=None,
+    concurrency=None,
 ) -> List:
     """Helper function to get klines from Binance for a single request
 
@@ -169,6 +347,17 @@ def get_klines(
         Maximum number of klines to fetch. Will be clamped to 1000 if higher
         due to current maximum Binance limit. A value <= 0 will be assumed as
         no limit, and 1000 will be used.
+    :param session: (requests.Session)
+        Session to issue the request through, so that connections can be
+        pooled across calls. If None, a module-level shared session is used.
+    :param limiter: (utils.TokenBucket)
+        Rate limiter shared by all threads making requests, counting request
+        weight (so its capacity must be at least KLINE_REQUEST_WEIGHT). Paused
+        for everyone when Binance reports the rate limit is exceeded or nearly
+        used up.
+    :param concurrency: (utils.AIMDLimiter)
+        Concurrency controller told about each response, so that it backs off
+        when Binance rejects (429) or fails (5xx) requests.
     :return: List[List]]
         Returns a list of klines in list format if successful (may be empty list)
     """
@@ -194,42 +383,201 @@ def get_klines(
     if start_time is not None:
         params["startTime"] = start_time
 
-    response = requests.get(KLINE_URL, params=params)
+    response = _get(
+        KLINE_URL,
+        params=params,
+        session=session,
+        limiter=limiter,
+        concurrency=concurrency,
+        weight=KLINE_REQUEST_WEIGHT,
+    )
+
+    return parse_json(response.content)
+
+
+def kline_ranges(
+    start_ms: int, end_ms: int, interval_ms: int, limit: int = 1000
+) -> List[Tuple[int, int]]:
+    """Split a span of time into the (start, end) windows needed to download it
+
+    :param start_ms: (int) first k-line open time wanted, in milliseconds
+    :param end_ms: (int) end of the span, in milliseconds
+    :param interval_ms: (int) k-line interval, in milliseconds
+    :param limit: (int) maximum number of k-lines returned per request. Must be
+        more than KLINE_WINDOW_OVERLAP + 1, so that each window moves forward
+    :return: List[Tuple[int, int]]
+        Start and end times (milliseconds) for each request. Consecutive windows
+        overlap by KLINE_WINDOW_OVERLAP intervals, so duplicates must be removed
+        when combining
+    """
+    if limit <= KLINE_WINDOW_OVERLAP + 1:
+        raise ValueError(
+            f"limit must be more than {KLINE_WINDOW_OVERLAP + 1} k-lines, got {limit}"
+        )
+    last_end = end_ms - interval_ms  # Cover up to given end date
+    if start_ms >= last_end:
+        return []
+    # Each window covers `limit` intervals, and the next one starts
+    # KLINE_WINDOW_OVERLAP intervals before it ends (duplicates filtered out later)
+    # to ensure we don't miss any of the range if Binance screwed up some of their data
+    overlap = KLINE_WINDOW_OVERLAP * interval_ms
+    step = (limit - 1) * interval_ms - overlap
+    # Keep adding windows until one reaches the end date
+    starts = np.arange(
+        start_ms, max(last_end - overlap, start_ms + 1), step, dtype=np.int64
+    )
+    ends = np.minimum(starts + (limit - 1) * interval_ms, last_end)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def api_session(pool_connections: int = 1, pool_maxsize: int = 1) -> requests.Session:
+    """Create a session for API requests with keep-alive connection pooling
 
-    # Check for valid response
+    Requests made through the session are retried according to RETRY_POLICY
+
+    :param pool_connections: (int) number of hosts to keep connection pools for
+    :param pool_maxsize: (int) connections kept open per host; should be at least
+        the number of threads sharing the session
+    :return: requests.Session
+    """
+    session = requests.Session()
+    session.headers.update(
+        {
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip, deflate",
+            "User-Agent": f"binance-downloader/{__version__}",
+        }
+    )
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=RETRY_POLICY,
+        ),
+    )
+    return session
+
+
+# Shared by requests made outside of a BinanceAPI instance
+_SESSION = api_session()
+
+
+def _get(
+    url: str, params=None, session=None, limiter=None, concurrency=None, weight=1
+) -> requests.Response:
+    """GET from the API, pacing requests through `limiter` if one is given
+
+    Each attempt takes `weight` tokens from the limiter, the request weight
+    Binance charges for it.
+
+    A 429 response is retried after the delay given in its Retry-After header.
+    With a limiter, that delay (and any pause triggered by the used request
+    weight reported by Binance) applies to every thread sharing the limiter.
+    With a concurrency controller, every response is recorded as a success, or
+    as a failure if it (or a retry behind it) was a 429 or 5xx.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES):
+        if limiter is not None:
+            limiter.acquire(weight)
+        response = (session or _SESSION).get(
+            url, params=params, timeout=REQUEST_TIMEOUT
+        )
+        if limiter is not None:
+            _pause_if_near_weight_limit(response, limiter)
+        if concurrency is not None:
+            concurrency.record(success=not _server_overloaded(response))
+        if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES - 1:
+            break
+
+        wait = float(response.headers.get("Retry-After", 2 ** attempt))
+        log.warn("Rate limit exceeded, retrying request in {} seconds", wait)
+        if limiter is not None:
+            limiter.pause(wait)
+        else:
+            time.sleep(wait)
+
+    # Check for valid response (retries have been exhausted by this point)
     _validate_api_response(response)
+    return response
+
+
+def _server_overloaded(response: requests.Response) -> bool:
+    """Whether the response, or any attempt retried by urllib3 before it, was a
+    rate limit rejection or server error"""
+    if response.status_code == 429 or response.status_code >= 500:
+        return True
+    retries = getattr(response.raw, "retries", None)
+    history = retries.history if retries is not None else ()
+    return any(
+        attempt.status is not None and attempt.status >= 500 for attempt in history
+    )
+
+
+def _pause_if_near_weight_limit(response: requests.Response, limiter) -> None:
+    used_weight = response.headers.get("X-MBX-USED-WEIGHT-1M")
+    if used_weight is None:
+        return
+    weight_limit = _weight_limit_per_minute()
+    if weight_limit is None:
+        return
+    if int(used_weight) >= WEIGHT_PAUSE_FRACTION * weight_limit:
+        # Binance counts request weight in fixed one-minute windows
+        wait = 60 - time.time() % 60
+        log.notice(
+            "Used {} of {} request weight; pausing requests for {:.1f} seconds",
+            used_weight,
+            weight_limit,
+            wait,
+        )
+        limiter.pause(wait)
 
-    return response.json()
+
+def _weight_limit_per_minute() -> Optional[int]:
+    for limit in _req_limits(get_exchange_info()):
+        if (
+            limit["rateLimitType"] == "REQUEST_WEIGHT"
+            and _rate_limit_seconds(limit) == 60
+        ):
+            return int(limit["limit"])
+    return None
 
 
 def _validate_api_response(response):
-    if response.status_code in [429, 418]:
-        raise ConnectionError(f"Rate limits exceeded or IP banned: {response.json()}")
-    elif response.status_code % 100 == 4:
-        raise ConnectionError(f"Request error: {response.json()}")
-    elif response.status_code % 100 == 5:
-        raise ConnectionError(f"API error, status is unknown: {response.json()}")
-    elif response.status_code != 200:
-        raise ConnectionError(f"Unknown error on kline request: {response.json()}")
+    status = response.status_code
+    if status == 200:
+        return
+    message = _STATUS_ERRORS.get(status)
+    if message is None:
+        if 400 <= status < 500:
+            message = "Request error"
+        elif 500 <= status < 600:
+            message = "API error, status is unknown"
+        else:
+            message = "Unknown error on kline request"
+    raise ConnectionError(f"{message}: {response.text}")
 
 
+@lru_cache(maxsize=1024)
 def earliest_valid_timestamp(symbol: str, interval: str) -> int:
-    if interval not in KLINE_INTERVALS:
+    if interval not in KLINE_INTERVAL_SET:
         raise ValueError(f"{interval} is not a valid kline interval")
 
     # Check for locally cached response
     identifier = f"{symbol}_{interval}"
-    prev_json = json_from_cache(EARLIEST_TIMESTAMPS_FILE)
+    with _EARLIEST_TIMESTAMPS_LOCK:
+        prev_json = json_from_cache(EARLIEST_TIMESTAMPS_FILE)
     if prev_json:
         # Loaded JSON from disk, check if we already have this value:
         timestamp = prev_json.get(identifier, None)
         if timestamp is not None:
             log.info(
-                f"Found cached earliest timestamp for {identifier}: "
-                f"{pd.to_datetime(timestamp, unit='ms')}"
+                "Found cached earliest timestamp for {}: {}",
+                identifier,
+                pd.to_datetime(timestamp, unit="ms"),
             )
             return timestamp
-    log.info(f"No cached earliest timestamp for {identifier}, so fetching from server")
+    log.info("No cached earliest timestamp for {}, so fetching from server", identifier)
 
     # This will return the first recorded k-line for this interval and symbol
     kline = get_klines(symbol, interval, start_time=0, limit=1)
@@ -237,40 +585,66 @@ def earliest_valid_timestamp(symbol: str, interval: str) -> int:
     # Get just the OpenTime value (timestamp in milliseconds)
     earliest_timestamp = int(kline[0][0])
 
-    # Cache on disk
-    prev_json[identifier] = earliest_timestamp
-    json_to_cache(prev_json, EARLIEST_TIMESTAMPS_FILE)
-    log.info(f"Wrote new data to {EARLIEST_TIMESTAMPS_FILE} for {identifier}")
+    # Cache on disk. Re-read under the lock so that entries added by other
+    # threads since the lookup above are kept
+    with _EARLIEST_TIMESTAMPS_LOCK:
+        prev_json = json_from_cache(EARLIEST_TIMESTAMPS_FILE)
+        prev_json[identifier] = earliest_timestamp
+        json_to_cache(prev_json, EARLIEST_TIMESTAMPS_FILE)
+    log.info("Wrote new data to {} for {}", EARLIEST_TIMESTAMPS_FILE, identifier)
 
     return earliest_timestamp
 
 
 def kline_df_from_flat_list(flat_list: List):
-    df = pd.DataFrame(
-        flat_list,
-        columns=[
-            "OpenTime",
-            "Open",
-            "High",
-            "Low",
-            "Close",
-            "Volume",
-            "CloseTime",
-            "qav",
-            "numTrades",
-            "tbbav",
-            "tbqav",
-            "ignore",
-        ],
-    )
-    # Fix dates
-    df.OpenTime = pd.to_datetime(df.OpenTime, unit="ms")
-    df.CloseTime = pd.to_datetime(df.CloseTime, unit="ms")
-    # Fix numeric values
-    for f in ["Open", "High", "Low", "Close", "Volume"]:
-        df[f] = pd.to_numeric(df[f])
-    # Sort by interval open
-    df = df.sort_values("OpenTime")
-    # Remove duplicates (from interval overlaps)
-    df = df.drop_duplicates("OpenTime").reset_index(drop=True)
-    return df
+    return combine_kline_frames([kline_frame(flat_list)])
+
+
+def kline_frame(klines: List, columns=None) -> pd.DataFrame:
+    """Convert the k-lines from one API response into a typed DataFrame
+
+    Rows are left in the order received; see combine_kline_frames
+
+    :param klines: List[List] k-lines as returned by get_klines
+    :param columns: (Iterable[str]) names from KLINE_COLUMNS to keep. OpenTime
+        is always kept, since k-lines are sorted and de-duplicated by it.
+        Default: all columns
+    :return: pandas.DataFrame
+    """
+    if columns is None:
+        names = KLINE_COLUMNS
+    else:
+        # Keep the API's column order; unused columns are never converted
+        wanted = set(columns) | {"OpenTime"}
+        names = [name for name in KLINE_COLUMNS if name in wanted]
+
+    # Split the row-oriented API response into one array per column, casting each
+    # as it is split, instead of building an all-object frame and converting it
+    rows = np.asarray(klines, dtype=object).reshape(-1, len(KLINE_COLUMNS))
+    data = {}
+    for i, name in enumerate(KLINE_COLUMNS):
+        if name not in names:
+            continue
+        if name in TIME_COLUMNS:
+            # Fix dates
+            data[name] = pd.to_datetime(rows[:, i].astype("int64"), unit="ms")
+        elif name in KLINE_DTYPES:
+            data[name] = rows[:, i].astype(KLINE_DTYPES[name])
+        else:
+            data[name] = rows[:, i]
+    return pd.DataFrame(data, columns=names)
+
+
+def combine_kline_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Merge typed k-line frames, sorted by open time and without duplicates
+
+    :param frames: List[pandas.DataFrame] frames built by kline_frame
+    :return: pandas.DataFrame
+    """
+    if not frames:
+        frames = [kline_frame([])]
+    df = pd.concat(frames, ignore_index=True)
+    # Sort by interval open and remove duplicates (from interval overlaps) in a
+    # single pass, keeping the first copy received of each k-line
+    _, first_rows = np.unique(df["OpenTime"].values, return_index=True)
+    return df.iloc[first_rows].reset_index(drop=True)
@@ -1,14 +1,27 @@
 import argparse
 
-from logbook import Logger
+from logbook import Logger, TimedRotatingFileHandler
 
-from .api import BinanceAPI
-from .binance_utils import date_to_milliseconds
+from .api import BinanceAPI, check_output_format
+from .binance_utils import KLINE_COLUMNS, date_to_milliseconds
+from .utils import ensure_dir
 
 log = Logger(__name__)
 
+LOG_FILENAME = "./logs/bd_applog.log"
+
+DATE_FORMATS = frozenset(("DMY", "MDY", "YMD"))
+
+
+def _install_logging():
+    # Log to file (date-based). Only done for CLI runs, so importing the package
+    # as a library doesn't create a log directory and hold open a log file
+    ensure_dir(LOG_FILENAME)
+    TimedRotatingFileHandler(LOG_FILENAME, bubble=True).push_application()
+
 
 def main():
+    _install_logging()
     log.info("*" * 80)
     log.info("***" + "Starting CLI Parser for binance-downloader".center(74) + "***")
     log.info("*" * 80)
@@ -29,7 +42,16 @@ def main():
     )
     parser.add_argument(
         "--output",
-        help="File name to write data. Default: ./downloaded/timestamp_symbol_interval",
+        help="File name to write data. Use a .parquet or .feather extension for "
+        "faster, smaller binary output (requires pyarrow), or .csv.gz for "
+        "gzip-compressed CSV. "
+        "Default: ./downloaded/timestamp_symbol_interval",
+    )
+    parser.add_argument(
+        "--columns",
+        help="Comma-separated k-line columns to keep, e.g. "
+        "OpenTime,Open,High,Low,Close,Volume. OpenTime is always kept. "
+        "Default: all columns",
     )
     # Allow to choose MM/DD/YYYY for date input
     parser.add_argument(
@@ -41,11 +63,29 @@ def main():
 
     args = parser.parse_args()
 
+    # Check the output can be written before spending time on the download
+    try:
+        check_output_format(args.output)
+    except ImportError as e:
+        parser.error(str(e))
+
+    if args.columns:
+        columns = [column.strip() for column in args.columns.split(",")]
+        unknown = [column for column in columns if column not in KLINE_COLUMNS]
+        if unknown:
+            parser.error(
+                "Unknown --columns: {}. Valid columns: {}".format(
+                    ", ".join(unknown), ",".join(KLINE_COLUMNS)
+                )
+            )
+    else:
+        columns = None
+
     if args.dtfmt:
-        if args.dtfmt in ["DMY", "MDY", "YMD"]:
+        if args.dtfmt in DATE_FORMATS:
             date_format = args.dtfmt
         else:
-            log.warn(f"Date format given ({args.dtfmt}) not known. Using YMD")
+            log.warn("Date format given ({}) not known. Using YMD", args.dtfmt)
             date_format = "YMD"
     else:
         date_format = "YMD"
@@ -62,6 +102,6 @@ def main():
 
     symbol = str(args.symbol)
     interval = str(args.interval)
-    binance = BinanceAPI(interval, symbol, start_date, end_date)
-    binance.fetch_parallel()
-    binance.write_to_csv()
+    with BinanceAPI(interval, symbol, start_date, end_date, columns=columns) as binance:
+        binance.fetch_parallel()
+        binance.write_to_file(args.output)
@@ -0,0 +1,25 @@
+from .db import Kline
+
+
+def kline(open_time, **overrides):
+    """One 1m k-line in the 12-field list form returned by the Binance API
+
+    :param open_time: (int) open time in milliseconds
+    :param overrides: values for any other field, named as in db.Kline
+    """
+    return list(
+        Kline(
+            open_time,
+            "1.5",
+            "2",
+            "1",
+            "1.75",
+            "10",
+            open_time + 59999,
+            "17.5",
+            4,
+            "5",
+            "8.75",
+            "0",
+        )._replace(**overrides)
+    )
@@ -1,40 +1,68 @@
 """Save data to csv file"""
-import csv
+
 import os
-from collections import namedtuple
-
-from binance_downloader.utils import timestamp_to_datetime
-
-KLINE = namedtuple(
-    "Kline",
-    (
-        "open_time",
-        "open_",
-        "high",
-        "low",
-        "close",
-        "volume",
-        "close_time",
-        "quote_asset_volume",
-        "number_of_trades",
-        "taker_by_bav",
-        "taker_by_qav",
-        "ignored",
-    ),
-)
+from typing import NamedTuple
+
+import pandas as pd
+
+from .utils import WRITE_BUFFER_SIZE
+
+
+class Kline(NamedTuple):
+    """One k-line as returned by the Binance API (decimals are sent as strings)"""
+
+    open_time: int
+    open_: str
+    high: str
+    low: str
+    close: str
+    volume: str
+    close_time: int
+    quote_asset_volume: str
+    number_of_trades: int
+    taker_by_bav: str
+    taker_by_qav: str
+    ignored: str
+
+
+# Kept for code written against the original namedtuple
+KLINE = Kline
+
+# strftime patterns for the date format names the CLI accepts (--dtfmt). The
+# time of day is kept so that k-lines shorter than a day stay distinguishable
+DATEFORMAT_PATTERNS = {
+    "YMD": "%Y-%m-%d %H:%M:%S",
+    "DMY": "%d-%m-%Y %H:%M:%S",
+    "MDY": "%m-%d-%Y %H:%M:%S",
+}
 
 
 def to_csv(klines, output="binance_downloader", dateformat=None):
-    """Save data in csv file"""
+    """Save data in csv file
+
+    :param dateformat: (str) strftime pattern for the date column, or one of the
+        names in DATEFORMAT_PATTERNS (any case). Default: full UTC timestamps
+    :raises ValueError: if dateformat is neither a known name nor a pattern
+    """
+    # Resolve the format once for the whole column
+    if dateformat and "%" not in dateformat:
+        try:
+            dateformat = DATEFORMAT_PATTERNS[dateformat.upper()]
+        except KeyError:
+            raise ValueError(
+                "Unknown date format {!r}: use one of {} or a strftime "
+                "pattern".format(dateformat, ", ".join(DATEFORMAT_PATTERNS))
+            )
     headers = ["date", "open", "high", "low", "close", "volume"]
     output = "{}.csv".format(output)
     exist_output = os.path.exists(output)
-    with open(output, "a", newline="") as file_:
-        f_csv = csv.writer(file_)
-        if not exist_output:
-            f_csv.writerow(headers)
-
-        for k in klines:
-            date = timestamp_to_datetime(k.open_time, dateformat)
-            row = (date, k.open_, k.high, k.low, k.close, k.volume)
-            f_csv.writerow(row)
+
+    # Format all rows in one vectorized pass rather than row by row
+    df = pd.DataFrame(list(klines), columns=KLINE._fields)
+    df = df[["open_time", "open_", "high", "low", "close", "volume"]]
+    dates = pd.to_datetime(df["open_time"], unit="ms", utc=True)
+    df["open_time"] = dates.dt.strftime(dateformat) if dateformat else dates
+    df.columns = headers
+    # Numeric fields never need quoting, so hand pandas one large buffered write
+    with open(output, "a", newline="", buffering=WRITE_BUFFER_SIZE) as file_:
+        df.to_csv(file_, header=not exist_output, index=False)
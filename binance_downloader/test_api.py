@@ -0,0 +1,133 @@
+import gzip
+import time
+
+import pandas as pd
+import pytest
+
+from . import api
+from .conftest import kline
+
+START = 1525478400000  # 2018-05-05 00:00:00 UTC
+MINUTE = 60000
+LARGE_QAV = "98765432109.87654321"
+
+
+def _fake_get_klines(symbol, interval, start_time, end_time, limit, **kwargs):
+    open_times = range(start_time, end_time + 1, MINUTE)[:limit]
+    return [kline(open_time, quote_asset_volume=LARGE_QAV) for open_time in open_times]
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    """Stub out the Binance API calls made by BinanceAPI"""
+    monkeypatch.setattr(api, "max_request_freq", lambda req_weight=1: 1000)
+    monkeypatch.setattr(api, "earliest_valid_timestamp", lambda symbol, interval: 0)
+    monkeypatch.setattr(api, "get_klines", _fake_get_klines)
+
+
+@pytest.fixture
+def binance(stub_api):
+    """BinanceAPI for 2500 1m k-lines, with the Binance API stubbed out"""
+    with api.BinanceAPI("1m", "ETHBTC", START, START + 2499 * MINUTE) as binance:
+        yield binance
+
+
+def test_csv_keeps_quote_volume_digits(binance, tmp_path):
+    binance.fetch_parallel()
+    output = str(tmp_path / "klines.csv")
+    binance.write_to_file(output)
+
+    with open(output) as csv_file:
+        header, first_row = csv_file.readline(), csv_file.readline()
+    assert header.split(",")[7] == "qav"
+    assert first_row.split(",")[7] == LARGE_QAV
+
+
+@pytest.mark.parametrize(
+    "file_name, writer",
+    [("k.parquet", "to_parquet"), ("k.feather", "to_feather"), ("k.csv", "to_csv")],
+)
+def test_write_to_file_picks_format_by_extension(
+    binance, tmp_path, monkeypatch, file_name, writer
+):
+    calls = []
+    for method in ("to_parquet", "to_feather", "to_csv"):
+        monkeypatch.setattr(
+            pd.DataFrame, method, lambda df, *args, m=method, **kwargs: calls.append(m)
+        )
+    binance.fetch_parallel()
+    binance.write_to_file(str(tmp_path / file_name))
+    assert calls == [writer]
+
+
+def test_write_to_file_gz_is_compressed_csv(binance, tmp_path):
+    binance.fetch_parallel()
+    binance.write_to_file(str(tmp_path / "k.csv"))
+    binance.write_to_file(str(tmp_path / "k.csv.gz"))
+    with gzip.open(str(tmp_path / "k.csv.gz"), "rt") as compressed:
+        with open(str(tmp_path / "k.csv")) as plain:
+            assert compressed.read() == plain.read()
+
+
+def test_check_output_format_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(api, "find_spec", lambda name: None)
+    with pytest.raises(ImportError):
+        api.check_output_format("klines.parquet")
+    api.check_output_format("klines.csv")
+    api.check_output_format(None)
+
+
+def test_stream_to_csv_matches_collected_download(binance, tmp_path):
+    streamed = str(tmp_path / "streamed.csv")
+    binance.fetch_parallel(stream_to=streamed)
+    # Streaming keeps nothing in memory, so there is nothing left to write
+    binance.write_to_file(str(tmp_path / "unused.csv"))
+    assert not (tmp_path / "unused.csv").exists()
+
+    collected = str(tmp_path / "collected.csv")
+    binance.fetch_parallel()
+    binance.write_to_file(collected)
+
+    with open(streamed) as streamed_file, open(collected) as collected_file:
+        lines = streamed_file.read().splitlines()
+        # Overlapping windows are de-duplicated and the header is written once
+        assert lines == collected_file.read().splitlines()
+    assert len(lines) == len(binance.kline_df) + 1
+    assert sum(line.startswith("OpenTime") for line in lines) == 1
+
+
+def test_stream_to_gz_is_compressed(binance, tmp_path):
+    output = str(tmp_path / "k.csv.gz")
+    binance.fetch_parallel(stream_to=output)
+    with gzip.open(output, "rt") as csv_file:
+        lines = csv_file.read().splitlines()
+    assert lines[0].startswith("OpenTime") and len(lines) > 2000
+
+
+def test_stream_to_columnar_format_is_rejected(binance, tmp_path):
+    with pytest.raises(ValueError):
+        binance.fetch_parallel(stream_to=str(tmp_path / "k.parquet"))
+
+
+def test_streaming_holds_back_requests_behind_a_slow_window(
+    stub_api, monkeypatch, tmp_path
+):
+    requested = []
+    requested_while_first_was_slow = []
+
+    def slow_first_window(symbol, interval, start_time, end_time, limit, **kwargs):
+        requested.append(start_time)
+        if start_time == START:
+            time.sleep(0.5)
+            requested_while_first_was_slow.append(len(requested))
+        return _fake_get_klines(symbol, interval, start_time, end_time, limit)
+
+    monkeypatch.setattr(api, "get_klines", slow_first_window)
+    end = START + 50 * 1000 * MINUTE
+    with api.BinanceAPI("1m", "ETHBTC", START, end, num_workers=4) as binance:
+        binance.fetch_parallel(stream_to=str(tmp_path / "k.csv"))
+
+    # Later windows wait for the first to be written instead of all 50 piling up
+    limit = 4 * api.WINDOWS_IN_FLIGHT_PER_WORKER
+    assert requested_while_first_was_slow == [limit]
+    assert len(requested) > limit
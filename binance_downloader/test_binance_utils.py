@@ -1,6 +1,156 @@
-from .binance_utils import get_exchange_info
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from . import binance_utils
+from .binance_utils import (
+    _get,
+    combine_kline_frames,
+    date_to_milliseconds,
+    get_exchange_info,
+    interval_to_milliseconds,
+    kline_df_from_flat_list,
+    kline_frame,
+    kline_ranges,
+)
+from .conftest import kline
+from .utils import AIMDLimiter
 
 
 def test_exchange_info_is_dict():
     info = get_exchange_info()
     assert isinstance(info, dict)
+
+
+def test_kline_df_is_sorted_and_deduplicated():
+    df = kline_df_from_flat_list([kline(120000), kline(0), kline(60000), kline(60000)])
+    assert len(df) == 3
+    assert df.OpenTime.is_monotonic_increasing
+    assert df.Open.dtype == "float64"
+    assert df.Close.iloc[0] == 1.75
+
+
+def test_kline_ranges_cover_span_with_overlap():
+    ranges = kline_ranges(0, 2500 * 60000, 60000, limit=1000)
+    assert ranges[0] == (0, 999 * 60000)
+    # Each window starts 10 intervals before the previous one ended
+    for (_, prev_end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == prev_end - 10 * 60000
+    assert ranges[-1][1] == 2499 * 60000
+
+
+@pytest.mark.parametrize("limit", [1, 10, 11])
+def test_kline_ranges_rejects_limit_within_overlap(limit):
+    with pytest.raises(ValueError):
+        kline_ranges(0, 2500 * 60000, 60000, limit=limit)
+
+
+def test_date_to_milliseconds_formats():
+    expected = 1525478400000  # 2018-05-05 00:00:00 UTC
+    assert date_to_milliseconds("2018/05/05") == expected
+    assert date_to_milliseconds("05/05/2018", date_format="DMY") == expected
+    assert date_to_milliseconds("05/05/2018", date_format="MDY") == expected
+    assert date_to_milliseconds("2018-05-05 00:00") == expected
+    assert date_to_milliseconds("2018-05-05T02:00:00+02:00") == expected
+    assert date_to_milliseconds(expected) == expected
+    # Inputs outside the fast layouts still go through pandas
+    assert date_to_milliseconds("5 May 2018") == expected
+
+
+def test_interval_to_milliseconds():
+    assert interval_to_milliseconds("1m") == 60000
+    assert interval_to_milliseconds("4h") == 4 * 60 * 60000
+    assert interval_to_milliseconds("1M") == 30 * 24 * 60 * 60000
+    assert interval_to_milliseconds("2x") is None
+
+
+def test_combine_kline_frames_merges_overlapping_chunks():
+    chunks = [[kline(60000), kline(120000)], [], [kline(0), kline(60000)]]
+    df = combine_kline_frames([kline_frame(chunk) for chunk in chunks])
+    assert list(df.OpenTime) == list(pd.to_datetime([0, 60000, 120000], unit="ms"))
+
+
+def test_kline_frame_keeps_requested_columns():
+    df = kline_frame([kline(0)], columns=["Close", "Volume"])
+    assert list(df.columns) == ["OpenTime", "Close", "Volume"]
+    assert df.Volume.iloc[0] == 10.0
+
+
+class _FakeResponse:
+    def __init__(self, status_code, headers=None, retried_statuses=()):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+        self.content = b"[]"
+        history = [SimpleNamespace(status=status) for status in retried_statuses]
+        self.raw = SimpleNamespace(retries=SimpleNamespace(history=history))
+
+
+class _FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def get(self, url, params=None, timeout=None):
+        return self.responses.pop(0)
+
+
+def test_get_records_rejections_with_concurrency_controller():
+    concurrency = AIMDLimiter(initial=4)
+    session = _FakeSession(
+        _FakeResponse(429, headers={"Retry-After": "0"}), _FakeResponse(200)
+    )
+    _get("url", session=session, concurrency=concurrency)
+    # Halved by the 429, then one step back up for the successful retry
+    assert concurrency.limit == 3
+
+    # Server errors retried inside urllib3 count as a failure too
+    _get(
+        "url",
+        session=_FakeSession(_FakeResponse(200, retried_statuses=(503,))),
+        concurrency=concurrency,
+    )
+    assert concurrency.limit == 1.5
+
+
+class _RecordingLimiter:
+    def __init__(self):
+        self.acquired = []
+        self.pauses = []
+
+    def acquire(self, tokens=1):
+        self.acquired.append(tokens)
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+def test_get_retries_rate_limited_request_after_retry_after():
+    limiter = _RecordingLimiter()
+    session = _FakeSession(
+        _FakeResponse(429, headers={"Retry-After": "3"}), _FakeResponse(200)
+    )
+    response = _get("url", session=session, limiter=limiter, weight=2)
+    assert response.status_code == 200
+    # Both attempts are paced, and the retry waits for everyone sharing the limiter
+    assert limiter.acquired == [2, 2]
+    assert limiter.pauses == [3.0]
+
+
+def test_get_pauses_when_request_weight_nearly_used(monkeypatch):
+    monkeypatch.setattr(binance_utils, "_weight_limit_per_minute", lambda: 1200)
+    limiter = _RecordingLimiter()
+    _get(
+        "url",
+        session=_FakeSession(_FakeResponse(200, {"X-MBX-USED-WEIGHT-1M": "1100"})),
+        limiter=limiter,
+    )
+    assert len(limiter.pauses) == 1 and 0 < limiter.pauses[0] <= 60
+
+    limiter = _RecordingLimiter()
+    _get(
+        "url",
+        session=_FakeSession(_FakeResponse(200, {"X-MBX-USED-WEIGHT-1M": "10"})),
+        limiter=limiter,
+    )
+    assert limiter.pauses == []
@@ -0,0 +1,43 @@
+import pytest
+
+from . import db
+from .conftest import kline
+
+
+def test_to_csv_date_format_name_keeps_time_of_day(tmp_path):
+    output = str(tmp_path / "klines")
+    db.to_csv([kline(0), kline(60000)], output, dateformat="DMY")
+
+    with open(output + ".csv") as csv_file:
+        dates = [line.split(",")[0] for line in csv_file.read().splitlines()[1:]]
+    assert dates == ["01-01-1970 00:00:00", "01-01-1970 00:01:00"]
+
+
+def test_to_csv_date_format_name_is_case_insensitive(tmp_path):
+    output = str(tmp_path / "klines")
+    db.to_csv([kline(0)], output, dateformat="ymd")
+
+    with open(output + ".csv") as csv_file:
+        assert csv_file.read().splitlines()[1].startswith("1970-01-01 00:00:00,")
+
+
+def test_to_csv_rejects_unknown_date_format(tmp_path):
+    output = str(tmp_path / "klines")
+    with pytest.raises(ValueError):
+        db.to_csv([kline(0)], output, dateformat="bogus")
+    assert not (tmp_path / "klines.csv").exists()
+
+
+def test_to_csv_appends_rows_with_header_only_once(tmp_path):
+    output = str(tmp_path / "klines")
+    db.to_csv([kline(0)], output)
+    db.to_csv([kline(60000), kline(120000)], output)
+
+    with open(output + ".csv") as csv_file:
+        lines = csv_file.read().splitlines()
+    assert lines == [
+        "date,open,high,low,close,volume",
+        "1970-01-01 00:00:00+00:00,1.5,2,1,1.75,10",
+        "1970-01-01 00:01:00+00:00,1.5,2,1,1.75,10",
+        "1970-01-01 00:02:00+00:00,1.5,2,1,1.75,10",
+    ]
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from .utils import AIMDLimiter, TokenBucket
+
+
+def test_token_bucket_paces_calls_to_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    # First token is available immediately, the other 5 take 1/50 sec each
+    assert time.perf_counter() - start >= 5 / 50 * 0.9
+
+
+def test_token_bucket_pause_holds_back_callers():
+    bucket = TokenBucket(rate=1000, capacity=1)
+    bucket.pause(0.1)
+    start = time.perf_counter()
+    bucket.acquire()
+    assert time.perf_counter() - start >= 0.09
+
+
+def test_aimd_limiter_adapts_limit():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=6)
+    for _ in range(5):
+        limiter.record(success=True)
+    assert limiter.limit == 6
+    limiter.record(success=False)
+    assert limiter.limit == 3
+
+
+def test_aimd_limiter_caps_requests_in_flight():
+    limiter = AIMDLimiter(initial=2)
+    limiter.acquire()
+    limiter.acquire()
+    blocked = threading.Thread(target=limiter.acquire)
+    blocked.start()
+    blocked.join(timeout=0.05)
+    assert blocked.is_alive()
+    limiter.release()
+    blocked.join(timeout=1)
+    assert not blocked.is_alive()
+
+
+def test_token_bucket_rejects_more_tokens_than_capacity():
+    bucket = TokenBucket(rate=100, capacity=1)
+    with pytest.raises(ValueError):
+        bucket.acquire(2)
@@ -2,57 +2,147 @@ import json
 import os
 import threading
 import time
-from functools import wraps
 from typing import Optional, Dict
 
 from logbook import Logger
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 CACHE_DIR = "cache/"
 
+# Size (bytes) of the buffer used when writing k-lines to disk
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 log = Logger(__name__)
 
 
-def rate_limited(max_per_second):
-    """Prevents the decorated function from being called more than
-    `max_per_second` times per second, locally, for one process
+class TokenBucket:
+    """Thread-safe token bucket for pacing calls to a rate-limited API
 
+    Tokens are added continuously at `rate` per second, up to `capacity`.
+    Each call to `acquire` consumes tokens, waiting until enough are available.
+    Waiting happens outside the lock, so other threads are never blocked
+    behind a sleeping one. `pause` holds back every caller for a given time,
+    e.g. when the server asks clients to back off.
     """
-    lock = threading.Lock()
-    min_interval = 1.0 / max_per_second
-
-    def decorate(func):
-        last_time_called = time.perf_counter()
 
-        @wraps(func)
-        def rate_limited_function(*args, **kwargs):
-            with lock:
-                nonlocal last_time_called
-                elapsed = time.perf_counter() - last_time_called
-                left_to_wait = min_interval - elapsed
-                if left_to_wait > 0:
-                    time.sleep(left_to_wait)
-                last_time_called = time.perf_counter()
-            return func(*args, **kwargs)
-
-        return rate_limited_function
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.perf_counter()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.perf_counter() + seconds)
+
+    def acquire(self, tokens: float = 1) -> None:
+        if tokens > self.capacity:
+            # The bucket can never hold that many tokens, so waiting would never end
+            raise ValueError(
+                f"Cannot acquire {tokens} tokens from a bucket with capacity "
+                f"{self.capacity}"
+            )
+        while True:
+            with self._lock:
+                now = time.perf_counter()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(
+                        self.capacity,
+                        self._tokens + (now - self._last_refill) * self.rate,
+                    )
+                    self._last_refill = now
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Adaptive cap on the number of requests in flight at once
+
+    `record` grows the cap by `increase` after each successful response and
+    multiplies it by `decrease` after each response showing the server is
+    overloaded (additive increase, multiplicative decrease), so concurrency
+    settles just below what the server tolerates. Each request holds a slot
+    between `acquire` and `release`.
+    """
 
-    return decorate
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        increase: float = 1,
+        decrease: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.limit = float(initial)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, success: bool) -> None:
+        with self._condition:
+            if success:
+                self.limit = min(self.maximum, self.limit + self.increase)
+            else:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            self._condition.notify_all()
 
 
 def ensure_dir(file_path):
     directory = os.path.dirname(file_path)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    # A bare file name lives in the current directory, which always exists.
+    # exist_ok avoids a separate existence check, and a race if another thread
+    # creates the directory first
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def parse_json(raw: bytes):
+    """Decode a JSON document, using the faster orjson parser if it is installed"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dump_json(data) -> bytes:
+    """Encode `data` as UTF-8 JSON, using the faster orjson encoder if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
 
 
 def json_from_cache(file_name: str) -> Optional[Dict]:
     json_path = os.path.join(CACHE_DIR, file_name)
     prev_json = {}
     try:
-        with open(json_path, "r") as infile:
-            prev_json = json.load(infile)
+        with open(json_path, "rb") as infile:
+            prev_json = parse_json(infile.read())
     except IOError:
-        log.warn(f"Error reading JSON from {json_path}")
+        log.warn("Error reading JSON from {}", json_path)
 
     return prev_json
 
@@ -60,5 +150,9 @@ def json_from_cache(file_name: str) -> Optional[Dict]:
 def json_to_cache(new_json: Dict, file_name: str) -> None:
     json_path = os.path.join(CACHE_DIR, file_name)
     ensure_dir(json_path)
-    with open(json_path, "w") as outfile:
-        json.dump(new_json, outfile, ensure_ascii=False)
+    # Write to a temporary file and swap it in, so a reader (or a crash part way
+    # through) never sees a half-written cache file
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, "wb") as outfile:
+        outfile.write(dump_json(new_json))
+    os.replace(tmp_path, json_path)